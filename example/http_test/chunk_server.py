@@ -1,58 +1,130 @@
 from http.server import BaseHTTPRequestHandler, HTTPServer
 import json
-import time
+import socket
+
+SOCKET_BUFFER_SIZE = 256 * 1024  # 内核收发缓冲区大小
+MAX_LINE = 65536  # 请求行与请求头单行的最大长度
+
+# 预先编码好的响应头，Connection 头按是否保持连接填入
+CONNECTION_HEADERS = {True: b"Connection: keep-alive\r\n",
+                      False: b"Connection: close\r\n"}
+NORMAL_HEADER = (b"HTTP/1.1 200 OK\r\n"
+                 b"%s"
+                 b"Content-Type: application/json\r\n"
+                 b"Content-Length: %d\r\n"
+                 b"\r\n")
+CHUNKED_HEADER = (b"HTTP/1.1 200 OK\r\n"
+                  b"%s"
+                  b"Transfer-Encoding: chunked\r\n"
+                  b"Content-Type: application/json\r\n"
+                  b"\r\n")
+NOT_FOUND_HEADER = (b"HTTP/1.1 404 Not Found\r\n"
+                    b"%s"
+                    b"Content-Length: 9\r\n"
+                    b"\r\n")
+BAD_REQUEST_RESPONSE = (b"HTTP/1.1 400 Bad Request\r\n"
+                        b"Connection: close\r\n"
+                        b"Content-Length: 0\r\n"
+                        b"\r\n")
+NOT_IMPLEMENTED_RESPONSE = (b"HTTP/1.1 501 Not Implemented\r\n"
+                            b"Connection: close\r\n"
+                            b"Content-Length: 0\r\n"
+                            b"\r\n")
+
+
+def build_chunked_body():
+    # 生成100个JSON数据
+    data = [{"id": i, "name": f"Item {i}"} for i in range(1, 10)]
+
+    # 分块数据先拼接完整，再一次性写出
+    out = bytearray()
+    dumps = json.dumps
+    for item in data:
+        # 每个块是一个紧凑格式的 JSON 对象，加上换行符
+        chunk_bytes = dumps(item, separators=(",", ":")).encode("utf-8") + b"\n"
+
+        # 块大小（以十六进制表示）、块数据、块数据结束标志
+        out += b"%x\r\n" % len(chunk_bytes)
+        out += chunk_bytes
+        out += b"\r\n"
+    # 最后一个块（大小为 0，表示结束）
+    out += b"0\r\n\r\n"
+    return bytes(out)
+
+
+# 返回的数据固定不变，启动时按是否保持连接各生成一次完整响应
+NORMAL_BODY = json.dumps([{"message": "This is a normal response"}] * 10,
+                         separators=(",", ":")).encode()
+CHUNKED_BODY = build_chunked_body()
+NORMAL_RESPONSES = {keep_alive: NORMAL_HEADER % (header, len(NORMAL_BODY)) + NORMAL_BODY
+                    for keep_alive, header in CONNECTION_HEADERS.items()}
+CHUNKED_RESPONSES = {keep_alive: CHUNKED_HEADER % header + CHUNKED_BODY
+                     for keep_alive, header in CONNECTION_HEADERS.items()}
+NOT_FOUND_RESPONSES = {keep_alive: NOT_FOUND_HEADER % header + b"Not Found"
+                       for keep_alive, header in CONNECTION_HEADERS.items()}
+
+
+class TunedHTTPServer(HTTPServer):
+    def server_bind(self):
+        # 在 listen 之前调大收发缓冲区，已接受的连接会继承该设置
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE)
+        super().server_bind()
 
 
 class MyRequestHandler(BaseHTTPRequestHandler):
-    def do_GET(self):
+    # 每个连接开启 TCP_NODELAY
+    disable_nagle_algorithm = True
+
+    def handle_one_request(self):
+        # 只解析请求行和 Connection 头，响应整体一次写出
+        self.close_connection = True
+        request_line = self.rfile.readline(MAX_LINE + 1)
+        if not request_line.strip():
+            return
+        parts = request_line.split()
+        if len(request_line) > MAX_LINE or len(parts) != 3:
+            # 过长、被截断或格式不对的请求行
+            self.wfile.write(BAD_REQUEST_RESPONSE)
+            return
+        method, path, version = parts
+
+        keep_alive = version == b"HTTP/1.1"
+        while True:
+            line = self.rfile.readline(MAX_LINE + 1)
+            if line in (b"\r\n", b"\n", b""):
+                break
+            if len(line) > MAX_LINE:
+                # 过长的请求头，剩余部分不再当作新的请求头解析
+                self.wfile.write(BAD_REQUEST_RESPONSE)
+                return
+            name, _, value = line.partition(b":")
+            if name.strip().lower() == b"connection":
+                value = value.strip().lower()
+                if value == b"close":
+                    keep_alive = False
+                elif value == b"keep-alive":
+                    keep_alive = True
+
         # 根据URL路径判断返回类型
-        if self.path == "/normal":
-            self.handle_normal_response()
-        elif self.path == "/chunked":
-            self.handle_chunked_response()
+        if method != b"GET":
+            # 不读取请求体，直接关闭连接
+            keep_alive = False
+            self.wfile.write(NOT_IMPLEMENTED_RESPONSE)
+        elif path == b"/normal":
+            self.handle_normal_response(keep_alive)
+        elif path == b"/chunked":
+            self.wfile.write(CHUNKED_RESPONSES[keep_alive])
         else:
-            self.send_response(404)
-            self.end_headers()
-            self.wfile.write(b"Not Found")
+            self.wfile.write(NOT_FOUND_RESPONSES[keep_alive])
+        self.close_connection = not keep_alive
 
-    def handle_normal_response(self):
+    def handle_normal_response(self, keep_alive):
         # 正常返回数据
-        self.send_response(200)
-        self.send_header("Connection", "keep-alive")
-        self.send_header("Content-type", "application/json")
-        self.end_headers()
-        response_data = []
-        for i in range(10):
-            response_data.append({"message": "This is a normal response"})
-        self.wfile.write(json.dumps(response_data).encode())
-
-    def handle_chunked_response(self):
-        # 分块返回JSON数据
-        self.send_response(200)
-        self.send_header("Connection", "keep-alive")
-        self.send_header("Transfer-Encoding", "chunked")
-        self.send_header("Content-type", "application/json")
-        self.end_headers()
-
-        # 生成100个JSON数据
-        data = [{"id": i, "name": f"Item {i}"} for i in range(1, 10)]
-
-        # 分块发送数据
-        for item in data:
-            chunk = json.dumps(item) + "\n"  # 每个块是一个 JSON 对象，加上换行符
-            chunk_bytes = chunk.encode("utf-8")
-            chunk_size = len(chunk_bytes)
-
-            # 发送块大小（以十六进制表示）和数据
-            self.wfile.write(f"{chunk_size:x}\r\n".encode("utf-8"))  # 发送块大小
-            self.wfile.write(chunk_bytes)  # 发送块数据
-            self.wfile.write("\r\n".encode("utf-8"))  # 块数据结束标志
-        time.sleep(1)
-        # 发送最后一个块（大小为 0，表示结束）
-        self.wfile.write("0\r\n\r\n".encode("utf-8"))
-
-
-def run(server_class=HTTPServer, handler_class=MyRequestHandler, port=8000):
+        self.wfile.write(NORMAL_RESPONSES[keep_alive])
+
+
+def run(server_class=TunedHTTPServer, handler_class=MyRequestHandler, port=8000):
     server_address = ("", port)
     httpd = server_class(server_address, handler_class)
     print(f"Starting httpd server on port {port}...")
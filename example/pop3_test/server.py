@@ -1,191 +1,355 @@
+import asyncio
+import logging
+import re
 import socket
 import threading
 import os
+import queue
 
 MAILBOX_DIR = "./mailbox"  # 每封邮件一个文件，文件名为 1.txt, 2.txt 等
 USERNAME = "user"
 PASSWORD = "pass"
+DEBUG = False  # 为 True 时记录每条收到的命令
+SOCKET_BUFFER_SIZE = 256 * 1024  # 内核收发缓冲区大小
+
+logger = logging.getLogger("pop3_server")
+
+# 固定响应预先编码为字节，直接追加到待发送缓冲区
+OK = b"+OK\r\n"
+OK_READY = b"+OK POP3 server ready\r\n"
+OK_USER = b"+OK User accepted\r\n"
+OK_AUTH = b"+OK Authenticated\r\n"
+OK_GOODBYE = b"+OK Goodbye\r\n"
+OK_RSET = b"+OK Deletion marks cleared\r\n"
+OK_UIDL = b"+OK unique-id listing follows\r\n"
+OK_TOP = b"+OK Top of message follows\r\n"
+ERR_USER = b"-ERR Invalid user\r\n"
+ERR_PASS = b"-ERR Invalid password\r\n"
+ERR_NOT_ALLOWED = b"-ERR Command not allowed\r\n"
+ERR_NOT_SUPPORTED = b"-ERR Command not supported\r\n"
+ERR_NO_SUCH = b"-ERR No such message\r\n"
+END = b".\r\n"
+HEADER_END = re.compile(rb"(?:\A|\r?\n)\r?\n")  # 邮件头部结束处的空行
+
+# 所有会话共享的只读邮箱缓存，邮箱目录的 mtime 变化时重新加载
+_mailbox_lock = threading.Lock()
+_mailbox_mtime = None
+_mailbox_cache = ((), (), (), (), (), 0)
+# 每封邮件的检查结果按 (路径, st_mtime_ns, st_size) 缓存，重新加载时只检查新增或修改过的文件
+_message_info = {}
+
+
+def load_messages():
+    # 只记录邮件文件路径，内容在 RETR/TOP 时再从磁盘读取
+    return [os.path.join(MAILBOX_DIR, fname)
+            for fname in sorted(os.listdir(MAILBOX_DIR)) if fname.endswith(".txt")]
+
+
+def join_lines(lines):
+    """以 CRLF 连接各行，并对以 . 开头的行做字节填充"""
+    if not lines:
+        return b""
+    out = b"\r\n".join(lines) + b"\r\n"
+    if out.startswith(b"."):
+        out = b"." + out
+    return out.replace(b"\r\n.", b"\r\n..")
+
+
+def to_crlf(content):
+    """将邮件内容转换为传输格式：每一行统一为 CRLF 结尾，以 . 开头的行前补一个 ."""
+    return join_lines(content.splitlines())
+
+
+def inspect_message(path):
+    """返回 (传输格式的大小, 尾部补齐)，尾部补齐为 None 表示文件含裸 LF/CR 或以 . 开头的行，不能直接 sendfile"""
+    with open(path, "rb") as f:
+        content = f.read()
+    normalized = to_crlf(content)
+    if content == normalized:
+        return len(normalized), b""
+    if content + b"\r\n" == normalized:
+        return len(normalized), b"\r\n"
+    return len(normalized), None
+
+
+def load_mailbox():
+    """返回 (邮件路径, 文件标识, 邮件大小, 尾部补齐, UID, 总大小)，仅在邮箱目录变化时重新加载"""
+    global _mailbox_mtime, _mailbox_cache, _message_info
+    mtime = os.stat(MAILBOX_DIR).st_mtime_ns
+    with _mailbox_lock:
+        if mtime != _mailbox_mtime:
+            # 预先计算每封邮件的大小与 UID，避免每条命令重复计算；
+            # 内容只在文件首次出现或被修改后读取一次用于检查格式，不常驻内存
+            paths, stamps, sizes, tails = [], [], [], []
+            message_info = {}
+            for path in load_messages():
+                try:
+                    st = os.stat(path)
+                    key = (path, st.st_mtime_ns, st.st_size)
+                    info = _message_info.get(key) or inspect_message(path)
+                except OSError:
+                    # 列目录之后被其他会话删除的邮件
+                    continue
+                message_info[key] = info
+                paths.append(path)
+                stamps.append(key[1:])
+                sizes.append(info[0])
+                tails.append(info[1])
+            uids = tuple(b"UID%04d" % (i + 1) for i in range(len(paths)))
+            _message_info = message_info
+            _mailbox_cache = (tuple(paths), tuple(stamps), tuple(sizes), tuple(tails), uids, sum(sizes))
+            _mailbox_mtime = mtime
+        return _mailbox_cache
 
 
 class Pop3Session:
-    def __init__(self, conn, addr):
-        self.conn = conn
-        self.addr = addr
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.addr = writer.get_extra_info("peername")
         self.state = "AUTH"
         self.username = ""
-        self.messages = self.load_messages()
+        self.paths, self.stamps, self.sizes, self.tails, self.uids, self.total_size = load_mailbox()
+        self.live_size = self.total_size  # 未标记删除邮件的总大小
         self.deleted = set()
+        self._out = bytearray()  # 当前命令的待发送响应
 
-    @staticmethod
-    def load_messages():
-        messages = []
-        for fname in sorted(os.listdir(MAILBOX_DIR)):
-            if fname.endswith(".txt"):
-                with open(os.path.join(MAILBOX_DIR, fname), "rb") as f:
-                    content = f.read()
-                    messages.append(content)
-        return messages
-
-    def send_line(self, line):
-        self.conn.sendall((line + "\r\n").encode())
+    async def flush(self):
+        # 一条命令的全部响应合并为一次写入
+        if self._out:
+            out, self._out = self._out, bytearray()
+            self.writer.write(out)
+            await self.writer.drain()
 
-    def handle(self):
-        self.send_line("+OK POP3 server ready")
-        buffer = ""  # 用于接收残留的命令片段
+    async def handle(self):
+        self._out += OK_READY
+        await self.flush()
 
-        while True:
+        while self.state != "UPDATE":
             try:
-                data = self.conn.recv(1024)
-                if not data:
+                line = await self.reader.readline()
+                if not line:
                     break
 
-                buffer += data.decode(errors='ignore')  # 累加数据
-                while '\r\n' in buffer:
-                    line, buffer = buffer.split('\r\n', 1)  # 分离一行命令
-                    line = line.strip()
-                    if not line:
-                        continue
+                line = line.rstrip(b"\r\n").decode(errors='ignore').strip()
+                if not line:
+                    continue
 
-                    print(f"[{self.addr}] >> {line}")
-                    parts = line.split()
-                    cmd = parts[0].upper()
-                    args = parts[1:]
+                if DEBUG:
+                    logger.debug("[%s] >> %s", self.addr, line)
+                parts = line.split()
+                cmd = parts[0].upper()
+                args = parts[1:]
 
-                    if self.state == "AUTH":
-                        self.handle_auth(cmd, args)
-                    elif self.state == "TRANSACTION":
-                        self.handle_transaction(cmd, args)
+                if self.state == "AUTH":
+                    self.handle_auth(cmd, args)
+                elif self.state == "TRANSACTION":
+                    await self.handle_transaction(cmd, args)
+                await self.flush()
 
             except Exception as e:
                 print(f"Error: {e}")
                 break
 
-        self.conn.close()
+        self.writer.close()
         self.cleanup_deleted()
 
     def handle_auth(self, cmd, args):
         if cmd == "USER":
             if args and args[0] == USERNAME:
-                self.send_line("+OK User accepted")
+                self._out += OK_USER
                 self.username = args[0]
             else:
-                self.send_line("-ERR Invalid user")
+                self._out += ERR_USER
         elif cmd == "PASS":
             if args and self.username == USERNAME and args[0] == PASSWORD:
-                self.send_line("+OK Authenticated")
+                self._out += OK_AUTH
                 self.state = "TRANSACTION"
             else:
-                self.send_line("-ERR Invalid password")
+                self._out += ERR_PASS
         elif cmd == "QUIT":
-            self.send_line("+OK Goodbye")
-            self.conn.close()
+            self._out += OK_GOODBYE
+            self.state = "UPDATE"
         else:
-            self.send_line("-ERR Command not allowed")
+            self._out += ERR_NOT_ALLOWED
 
-    def handle_transaction(self, cmd, args):
+    async def handle_transaction(self, cmd, args):
         if cmd == "STAT":
-            count = len(self.messages) - len(self.deleted)
-            size = sum(len(m) for i, m in enumerate(self.messages) if i not in self.deleted)
-            self.send_line(f"+OK {count} {size}")
+            count = len(self.paths) - len(self.deleted)
+            self._out += b"+OK %d %d\r\n" % (count, self.live_size)
         elif cmd == "LIST":
             if not args:
-                self.send_line(f"+OK {len(self.messages)} messages")
-                for i, m in enumerate(self.messages):
+                self._out += b"+OK %d messages\r\n" % len(self.paths)
+                for i, size in enumerate(self.sizes):
                     if i not in self.deleted:
-                        self.send_line(f"{i + 1} {len(m)}")
-                self.send_line(".")
+                        self._out += b"%d %d\r\n" % (i + 1, size)
+                self._out += END
             else:
                 index = int(args[0]) - 1
-                if 0 <= index < len(self.messages) and index not in self.deleted:
-                    self.send_line(f"+OK {index + 1} {len(self.messages[index])}")
+                if 0 <= index < len(self.paths) and index not in self.deleted:
+                    self._out += b"+OK %d %d\r\n" % (index + 1, self.sizes[index])
                 else:
-                    self.send_line("-ERR No such message")
+                    self._out += ERR_NO_SUCH
         elif cmd == "RETR":
             index = int(args[0]) - 1
-            if 0 <= index < len(self.messages) and index not in self.deleted:
-                self.send_line(f"+OK {len(self.messages[index])} octets")
-                for line in self.messages[index].splitlines():
-                    self.send_line(line.decode())
-                self.send_line(".")
+            if 0 <= index < len(self.paths) and index not in self.deleted:
+                # 先打开文件，文件已被其他会话删除时不能先回复 +OK
+                try:
+                    f = open(self.paths[index], "rb")
+                except OSError:
+                    self._out += ERR_NO_SUCH
+                    return
+                with f:
+                    tail = self.tails[index]
+                    st = os.fstat(f.fileno())
+                    if tail is None or (st.st_mtime_ns, st.st_size) != self.stamps[index]:
+                        # 需要转换格式的邮件，以及加载后被修改过的邮件，按当前内容转换并计算大小
+                        content = to_crlf(f.read())
+                        self._out += b"+OK %d octets\r\n" % len(content)
+                        self._out += content
+                    else:
+                        # 已是传输格式的邮件由内核直接从文件发送到套接字
+                        self._out += b"+OK %d octets\r\n" % self.sizes[index]
+                        await self.flush()
+                        if st.st_size:
+                            await asyncio.get_running_loop().sendfile(self.writer.transport, f,
+                                                                      count=st.st_size)
+                        self._out += tail
+                self._out += END
             else:
-                self.send_line("-ERR No such message")
+                self._out += ERR_NO_SUCH
         elif cmd == "DELE":
             index = int(args[0]) - 1
-            if 0 <= index < len(self.messages):
-                self.deleted.add(index)
-                self.send_line(f"+OK Message {index + 1} marked for deletion")
+            if 0 <= index < len(self.paths):
+                if index not in self.deleted:
+                    self.deleted.add(index)
+                    self.live_size -= self.sizes[index]
+                self._out += b"+OK Message %d marked for deletion\r\n" % (index + 1)
             else:
-                self.send_line("-ERR No such message")
+                self._out += ERR_NO_SUCH
         elif cmd == "NOOP":
-            self.send_line("+OK")
+            self._out += OK
         elif cmd == "RSET":
             self.deleted.clear()
-            self.send_line("+OK Deletion marks cleared")
+            self.live_size = self.total_size
+            self._out += OK_RSET
         elif cmd == "UIDL":
             if not args:
-                self.send_line("+OK unique-id listing follows")
-                for i, m in enumerate(self.messages):
+                self._out += OK_UIDL
+                for i, uid in enumerate(self.uids):
                     if i not in self.deleted:
-                        uid = f"UID{i + 1:04d}"
-                        self.send_line(f"{i + 1} {uid}")
-                self.send_line(".")
+                        self._out += b"%d %s\r\n" % (i + 1, uid)
+                self._out += END
             else:
                 index = int(args[0]) - 1
-                if 0 <= index < len(self.messages) and index not in self.deleted:
-                    self.send_line(f"+OK {index + 1} UID{index + 1:04d}")
+                if 0 <= index < len(self.paths) and index not in self.deleted:
+                    self._out += b"+OK %d %s\r\n" % (index + 1, self.uids[index])
                 else:
-                    self.send_line("-ERR No such message")
+                    self._out += ERR_NO_SUCH
         elif cmd == "TOP":
             index = int(args[0]) - 1
             n = int(args[1])
-            if 0 <= index < len(self.messages) and index not in self.deleted:
-                lines = self.messages[index].splitlines()
-                header = []
-                body = []
-                sep_found = False
-                for line in lines:
-                    if not sep_found and line == b'':
-                        sep_found = True
-                    if not sep_found:
-                        header.append(line)
-                    else:
-                        body.append(line)
-                self.send_line("+OK Top of message follows")
-                for line in header:
-                    self.send_line(line.decode())
-                for line in body[:n]:
-                    self.send_line(line.decode())
-                self.send_line(".")
+            if 0 <= index < len(self.paths) and index not in self.deleted:
+                try:
+                    with open(self.paths[index], "rb") as f:
+                        msg = f.read()
+                except OSError:
+                    self._out += ERR_NO_SUCH
+                    return
+                # 一次查找定位头部与正文之间的空行
+                sep = HEADER_END.search(msg)
+                self._out += OK_TOP
+                if sep is None:
+                    lines = msg.splitlines()
+                else:
+                    # 只向后扫描正文的前 n 行
+                    body = msg[sep.end():]
+                    end = 0
+                    for _ in range(n):
+                        nl = body.find(b"\n", end)
+                        if nl < 0:
+                            end = len(body)
+                            break
+                        end = nl + 1
+                    lines = msg[:sep.start()].splitlines() + [b""] + body[:end].splitlines()
+                self._out += join_lines(lines)
+                self._out += END
             else:
-                self.send_line("-ERR No such message")
+                self._out += ERR_NO_SUCH
         elif cmd == "QUIT":
-            self.send_line("+OK Goodbye")
-            self.conn.close()
+            self._out += OK_GOODBYE
+            self.state = "UPDATE"
         else:
-            self.send_line("-ERR Command not supported")
+            self._out += ERR_NOT_SUPPORTED
 
     def cleanup_deleted(self):
         for i in sorted(self.deleted, reverse=True):
-            path = os.path.join(MAILBOX_DIR, f"{i + 1}.txt")
+            path = self.paths[i]
             if os.path.exists(path):
                 os.remove(path)
 
 
+async def handle_pop3(reader, writer):
+    print(f"Connection from {writer.get_extra_info('peername')}")
+    await Pop3Session(reader, writer).handle()
+
+
+async def serve(host, port, reuse_port, started):
+    try:
+        server = await asyncio.start_server(handle_pop3, host, port, reuse_port=reuse_port,
+                                            start_serving=False)
+    except OSError as e:
+        # 绑定失败交给主线程处理
+        started.put(e)
+        return
+    # 在开始接受连接前调大收发缓冲区，已接受的连接会继承该设置；
+    # asyncio 的 TCP 传输默认开启 TCP_NODELAY
+    for sock in server.sockets:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE)
+    started.put(None)
+    async with server:
+        await server.serve_forever()
+
+
+def run_worker(cpu, host, port, reuse_port, started):
+    # 将事件循环线程绑定到指定 CPU
+    if cpu is not None:
+        os.sched_setaffinity(0, {cpu})
+    asyncio.run(serve(host, port, reuse_port, started))
+
+
 def start_server(host="127.0.0.1", port=110):
     if not os.path.exists(MAILBOX_DIR):
         os.makedirs(MAILBOX_DIR)
+    load_mailbox()
 
-    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server.bind((host, port))
-    server.listen()
-    print(f"POP3 server started on {host}:{port}...")
+    # 每个 CPU 一个事件循环，各自监听同一端口，由内核通过 SO_REUSEPORT 分发连接
+    if hasattr(socket, "SO_REUSEPORT") and hasattr(os, "sched_getaffinity"):
+        cpus = sorted(os.sched_getaffinity(0))
+    else:
+        cpus = [None]
+    reuse_port = len(cpus) > 1
+    if reuse_port:
+        # 先不带 SO_REUSEPORT 独占试绑一次，端口已被占用时直接失败，避免与其他进程分摊连接
+        socket.create_server((host, port)).close()
 
-    while True:
-        conn, addr = server.accept()
-        print(f"Connection from {addr}")
-        session = Pop3Session(conn, addr)
-        threading.Thread(target=session.handle, daemon=True).start()
+    started = queue.Queue()
+    workers = [threading.Thread(target=run_worker, args=(cpu, host, port, reuse_port, started),
+                                daemon=True)
+               for cpu in cpus]
+    for worker in workers:
+        worker.start()
+    # 等待所有事件循环完成监听，任一失败则直接抛出
+    for _ in workers:
+        error = started.get()
+        if error is not None:
+            raise error
+    print(f"POP3 server started on {host}:{port} with {len(workers)} event loop(s)...")
+    for worker in workers:
+        worker.join()
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG if DEBUG else logging.INFO)
     start_server()
@@ -1,10 +1,13 @@
-import socketserver
+import asyncio
+import socket
 import threading
 import time
 import base64
+import hmac
 import os
-from email.parser import Parser
-from io import StringIO
+import queue
+from email.parser import BytesParser
+from io import BytesIO
 from datetime import datetime
 
 # 简单的用户数据库
@@ -16,150 +19,199 @@ USER_DATABASE = {
 # 邮件存储目录
 MAIL_STORAGE_DIR = "received_emails"
 
-class SMTPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
-    allow_reuse_address = True
+# 内核收发缓冲区大小
+SOCKET_BUFFER_SIZE = 256 * 1024
 
-class SMTPHandler(socketserver.BaseRequestHandler):
-    def handle(self):
-        self.request.sendall(b'220 Welcome to Python SMTP Server\r\n')
+class SMTPHandler:
+    # 固定的多行响应在类加载时构造一次
+    EHLO_BANNER = b'250-Hello\r\n250-AUTH LOGIN\r\n250 HELP\r\n'
+    AUTH_USERNAME_CHALLENGE = b'334 VXNlcm5hbWU6\r\n'  # "Username:" in Base64
+    AUTH_PASSWORD_CHALLENGE = b'334 UGFzc3dvcmQ6\r\n'  # "Password:" in Base64
+
+    def __init__(self, reader, writer):
+        # asyncio 的 TCP 传输默认开启 TCP_NODELAY
+        self.reader = reader
+        self.writer = writer
+
+    async def handle(self):
+        self.writer.write(b'220 Welcome to Python SMTP Server\r\n')
         self.mail_from = None
         self.rcpt_to = []
-        self.data_buffer = bytearray()  # 改为字节缓冲区
+        self.data_buffer = BytesIO()  # 改为字节缓冲区
+        self.data_tail = b''  # 上一次 recv 末尾的字节，用于查找跨包的结束标记
         self.in_data_mode = False
         self.authenticated = False
         self.auth_username = None
         self.auth_state = None
 
-        while True:
+        self.cmd_buffer = bytearray()  # 尚未凑成完整一行的命令字节
+
+        running = True
+        while running:
             try:
-                data = self.request.recv(4096)  # 增大缓冲区
+                await self.writer.drain()
+                data = await self.reader.read(4096)  # 增大缓冲区
                 if not data:
                     break
 
                 if self.in_data_mode:
-                    # 添加到缓冲区
-                    self.data_buffer.extend(data)
-
-                    # 检查是否收到结束标记\r\n.\r\n
-                    if b'\r\n.\r\n' in self.data_buffer:
-                        # 提取完整消息（不包括结束标记）
-                        end_pos = self.data_buffer.index(b'\r\n.\r\n')
-                        message_data = self.data_buffer[:end_pos]
-
-                        # 处理消息
-                        self.in_data_mode = False
-                        self.data = message_data.decode('utf-8', errors='replace')
-                        self.process_message()
-                        self.request.sendall(b'250 Message accepted for delivery\r\n')
-
-                        # 清空缓冲区
-                        self.data_buffer.clear()
-                else:
-                    # 将命令转换为字符串处理
-                    command_str = data.decode('utf-8').strip()
-
-                    # 处理AUTH流程中的用户名和密码输入
-                    if self.auth_state == 'waiting_for_username':
-                        try:
-                            self.auth_username = base64.b64decode(command_str).decode('utf-8')
-                            self.auth_state = 'waiting_for_password'
-                            self.request.sendall(b'334 UGFzc3dvcmQ6\r\n')  # "Password:" in Base64
-                            continue
-                        except:
-                            self.request.sendall(b'501 Syntax error in parameters or arguments\r\n')
-                            self.auth_state = None
-                            continue
-
-                    if self.auth_state == 'waiting_for_password':
-                        try:
-                            password = base64.b64decode(command_str).decode('utf-8')
-                            if self.auth_username in USER_DATABASE and USER_DATABASE[self.auth_username] == password:
-                                self.authenticated = True
-                                self.request.sendall(b'235 Authentication successful\r\n')
-                            else:
-                                self.request.sendall(b'535 Authentication credentials invalid\r\n')
-                            self.auth_state = None
-                            continue
-                        except:
-                            self.request.sendall(b'501 Syntax error in parameters or arguments\r\n')
-                            self.auth_state = None
-                            continue
-
-                    # 常规命令处理
-                    command = command_str.upper().split()[0] if command_str else ''
-                    args = command_str[len(command):].strip() if command_str else ''
-
-                    if command == 'HELO':
-                        self.request.sendall(b'250 Hello\r\n')
-                    elif command == 'EHLO':
-                        response = [
-                            '250-Hello',
-                            '250-AUTH LOGIN',
-                            '250 HELP'
-                        ]
-                        self.request.sendall('\r\n'.join(response).encode('utf-8') + b'\r\n')
-                    elif command == 'AUTH':
-                        if args.upper().startswith('LOGIN'):
-                            self.auth_state = 'waiting_for_username'
-                            self.request.sendall(b'334 VXNlcm5hbWU6\r\n')  # "Username:" in Base64
-                        else:
-                            self.request.sendall(b'504 Unrecognized authentication type\r\n')
-                    elif command == 'MAIL':
-                        if not self.authenticated:
-                            self.request.sendall(b'530 Authentication required\r\n')
-                        elif args.upper().startswith('FROM:'):
-                            self.mail_from = args[5:].strip()
-                            self.request.sendall(b'250 OK\r\n')
-                        else:
-                            self.request.sendall(b'501 Syntax error in parameters or arguments\r\n')
-                    elif command == 'RCPT':
-                        if not self.authenticated:
-                            self.request.sendall(b'530 Authentication required\r\n')
-                        elif args.upper().startswith('TO:'):
-                            self.rcpt_to.append(args[3:].strip())
-                            self.request.sendall(b'250 OK\r\n')
-                        else:
-                            self.request.sendall(b'501 Syntax error in parameters or arguments\r\n')
-                    elif command == 'DATA':
-                        if not self.authenticated:
-                            self.request.sendall(b'530 Authentication required\r\n')
-                        else:
-                            self.request.sendall(b'354 Start mail input; end with <CRLF>.<CRLF>\r\n')
-                            self.in_data_mode = True
-                            self.data_buffer.clear()  # 准备接收数据
-                    elif command == 'QUIT':
-                        self.request.sendall(b'221 Bye\r\n')
+                    # 结束标记之后的字节是下一条命令
+                    data = self.handle_data(data)
+                    if not data:
+                        continue
+
+                # 命令均为 ASCII 单行，直接在字节上按行切分
+                self.cmd_buffer.extend(data)
+                while True:
+                    idx = self.cmd_buffer.find(b'\n')
+                    if idx < 0:
+                        break
+                    line = bytes(self.cmd_buffer[:idx]).strip()
+                    del self.cmd_buffer[:idx + 1]
+                    if not self.handle_command(line):
+                        running = False
                         break
-                    elif command == 'NOOP':
-                        self.request.sendall(b'250 OK\r\n')
-                    elif command == 'RSET':
-                        self.mail_from = None
-                        self.rcpt_to = []
-                        self.data = ''
-                        self.authenticated = False
-                        self.auth_username = None
-                        self.auth_state = None
-                        self.data_buffer.clear()
-                        self.request.sendall(b'250 OK\r\n')
-                    elif command == 'VRFY':
-                        self.request.sendall(b'252 Cannot VRFY user\r\n')
-                    else:
-                        self.request.sendall(b'500 Command not recognized\r\n')
+                    if self.in_data_mode:
+                        # DATA 之后同一次 recv 中剩余的字节属于邮件内容
+                        rest = bytes(self.cmd_buffer)
+                        self.cmd_buffer.clear()
+                        if rest:
+                            self.cmd_buffer.extend(self.handle_data(rest))
+                        if self.in_data_mode:
+                            break
             except Exception as e:
                 print(f"Error handling client: {e}")
                 break
 
+        self.writer.close()
+
+    def handle_data(self, data):
+        """接收邮件内容，返回结束标记之后剩余的字节（邮件尚未结束时为空）"""
+        # 结束标记可能跨越两次 recv，只需在旧数据末尾 4 字节和新数据中查找
+        window = self.data_tail + data
+        # 添加到缓冲区
+        self.data_buffer.write(data)
+
+        # 检查是否收到结束标记\r\n.\r\n
+        end_pos = window.find(b'\r\n.\r\n')
+        if end_pos >= 0:
+            # 提取完整消息（不包括结束标记）
+            self.data_buffer.truncate(self.data_buffer.tell() - len(window) + end_pos)
+
+            # 处理消息
+            self.in_data_mode = False
+            self.data = self.data_buffer.getvalue()
+            self.process_message()
+            self.writer.write(b'250 Message accepted for delivery\r\n')
+
+            # 清空缓冲区
+            self.reset_data_buffer()
+            return window[end_pos + 5:]
+        self.data_tail = window[-4:]
+        return b''
+
+    def handle_command(self, line):
+        """处理一行命令，返回 False 表示客户端已 QUIT"""
+        # 处理AUTH流程中的用户名和密码输入
+        if self.auth_state == 'waiting_for_username':
+            try:
+                self.auth_username = base64.b64decode(line).decode('ascii', errors='replace')
+                self.auth_state = 'waiting_for_password'
+                self.writer.write(self.AUTH_PASSWORD_CHALLENGE)
+            except:
+                self.writer.write(b'501 Syntax error in parameters or arguments\r\n')
+                self.auth_state = None
+            return True
+
+        if self.auth_state == 'waiting_for_password':
+            try:
+                password = base64.b64decode(line)
+                expected = USER_DATABASE.get(self.auth_username)
+                # 直接比较字节，并使用常数时间比较避免时序侧信道
+                if expected is not None and hmac.compare_digest(expected.encode(), password):
+                    self.authenticated = True
+                    self.writer.write(b'235 Authentication successful\r\n')
+                else:
+                    self.writer.write(b'535 Authentication credentials invalid\r\n')
+            except:
+                self.writer.write(b'501 Syntax error in parameters or arguments\r\n')
+            self.auth_state = None
+            return True
+
+        # 常规命令处理
+        parts = line.split(None, 1)
+        command = parts[0].upper() if parts else b''
+        args = parts[1] if len(parts) > 1 else b''
+
+        if command == b'HELO':
+            self.writer.write(b'250 Hello\r\n')
+        elif command == b'EHLO':
+            self.writer.write(self.EHLO_BANNER)
+        elif command == b'AUTH':
+            if args.upper().startswith(b'LOGIN'):
+                self.auth_state = 'waiting_for_username'
+                self.writer.write(self.AUTH_USERNAME_CHALLENGE)
+            else:
+                self.writer.write(b'504 Unrecognized authentication type\r\n')
+        elif command == b'MAIL':
+            if not self.authenticated:
+                self.writer.write(b'530 Authentication required\r\n')
+            elif args.upper().startswith(b'FROM:'):
+                self.mail_from = args[5:].strip().decode('utf-8', errors='replace')
+                self.writer.write(b'250 OK\r\n')
+            else:
+                self.writer.write(b'501 Syntax error in parameters or arguments\r\n')
+        elif command == b'RCPT':
+            if not self.authenticated:
+                self.writer.write(b'530 Authentication required\r\n')
+            elif args.upper().startswith(b'TO:'):
+                self.rcpt_to.append(args[3:].strip().decode('utf-8', errors='replace'))
+                self.writer.write(b'250 OK\r\n')
+            else:
+                self.writer.write(b'501 Syntax error in parameters or arguments\r\n')
+        elif command == b'DATA':
+            if not self.authenticated:
+                self.writer.write(b'530 Authentication required\r\n')
+            else:
+                self.writer.write(b'354 Start mail input; end with <CRLF>.<CRLF>\r\n')
+                self.in_data_mode = True
+                self.reset_data_buffer()  # 准备接收数据
+        elif command == b'QUIT':
+            self.writer.write(b'221 Bye\r\n')
+            return False
+        elif command == b'NOOP':
+            self.writer.write(b'250 OK\r\n')
+        elif command == b'RSET':
+            self.mail_from = None
+            self.rcpt_to = []
+            self.data = b''
+            self.authenticated = False
+            self.auth_username = None
+            self.auth_state = None
+            self.reset_data_buffer()
+            self.writer.write(b'250 OK\r\n')
+        elif command == b'VRFY':
+            self.writer.write(b'252 Cannot VRFY user\r\n')
+        else:
+            self.writer.write(b'500 Command not recognized\r\n')
+        return True
+
+    def reset_data_buffer(self):
+        self.data_buffer.seek(0)
+        self.data_buffer.truncate()
+        self.data_tail = b''
+
     def process_message(self):
         print("\nReceived new email:")
         print(f"From: {self.mail_from}")
         print(f"To: {', '.join(self.rcpt_to)}")
         print(f"Authenticated as: {self.auth_username}")
         print("Message:")
-        print(self.data)
+        print(self.data.decode('utf-8', errors='replace'))
 
         # Parse the email
-        email_parser = Parser()
-        msg = email_parser.parse(StringIO(self.data))
+        email_parser = BytesParser()
+        msg = email_parser.parsebytes(self.data)
 
         print("\nParsed email headers:")
         for header, value in msg.items():
@@ -171,7 +223,7 @@ class SMTPHandler(socketserver.BaseRequestHandler):
         # Reset for next message
         self.mail_from = None
         self.rcpt_to = []
-        self.data = ''
+        self.data = b''
 
     def save_email_to_file(self, msg):
         """保存邮件内容到文件"""
@@ -186,7 +238,7 @@ class SMTPHandler(socketserver.BaseRequestHandler):
             filepath = os.path.join(MAIL_STORAGE_DIR, filename)
 
             # 保存原始邮件内容
-            with open(filepath, 'w', encoding='utf-8') as f:
+            with open(filepath, 'wb') as f:
                 print(repr(self.data))
                 f.write(self.data)
 
@@ -209,26 +261,69 @@ class SMTPHandler(socketserver.BaseRequestHandler):
         except Exception as e:
             print(f"Error saving email: {e}")
 
+async def handle_smtp(reader, writer):
+    await SMTPHandler(reader, writer).handle()
+
+async def serve(host, port, reuse_port, started):
+    try:
+        server = await asyncio.start_server(handle_smtp, host, port, reuse_port=reuse_port,
+                                            start_serving=False)
+    except OSError as e:
+        # 绑定失败交给主线程处理
+        started.put(e)
+        return
+    # 在开始接受连接前调大收发缓冲区，已接受的连接会继承该设置
+    for sock in server.sockets:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE)
+    started.put(None)
+    async with server:
+        await server.serve_forever()
+
+def run_worker(cpu, host, port, reuse_port, started):
+    # 将事件循环线程绑定到指定 CPU
+    if cpu is not None:
+        os.sched_setaffinity(0, {cpu})
+    asyncio.run(serve(host, port, reuse_port, started))
+
 def run_smtp_server(host='localhost', port=1025):
     # 确保邮件存储目录存在
     os.makedirs(MAIL_STORAGE_DIR, exist_ok=True)
 
-    server = SMTPServer((host, port), SMTPHandler)
-    print(f"SMTP server running on {host}:{port}")
-    print(f"Available users: {', '.join(USER_DATABASE.keys())}")
-    print(f"Emails will be saved to: {os.path.abspath(MAIL_STORAGE_DIR)}")
+    # 每个 CPU 一个事件循环，各自监听同一端口，由内核通过 SO_REUSEPORT 分发连接
+    if hasattr(socket, 'SO_REUSEPORT') and hasattr(os, 'sched_getaffinity'):
+        cpus = sorted(os.sched_getaffinity(0))
+    else:
+        cpus = [None]
+    reuse_port = len(cpus) > 1
+    if reuse_port:
+        # 先不带 SO_REUSEPORT 独占试绑一次，端口已被占用时直接失败，避免与其他进程分摊连接
+        socket.create_server((host, port)).close()
 
+    started = queue.Queue()
+    workers = []
     try:
-        server_thread = threading.Thread(target=server.serve_forever)
-        server_thread.daemon = True
-        server_thread.start()
+        for cpu in cpus:
+            worker = threading.Thread(target=run_worker, args=(cpu, host, port, reuse_port, started))
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+
+        # 等待所有事件循环完成监听，任一失败则直接抛出
+        for _ in workers:
+            error = started.get()
+            if error is not None:
+                raise error
+
+        print(f"SMTP server running on {host}:{port} with {len(workers)} event loop(s)")
+        print(f"Available users: {', '.join(USER_DATABASE.keys())}")
+        print(f"Emails will be saved to: {os.path.abspath(MAIL_STORAGE_DIR)}")
 
-        while True:
+        # 任一事件循环线程退出时结束服务
+        while all(worker.is_alive() for worker in workers):
             time.sleep(1)
     except KeyboardInterrupt:
         print("\nShutting down server...")
-        server.shutdown()
-        server.server_close()
 
 if __name__ == '__main__':
-    run_smtp_server()
\ No newline at end of file
+    run_smtp_server()
@@ -1,7 +1,13 @@
+import logging
 import socket
 
 HOST = '127.0.0.1'  # 监听本地地址（可改为 '0.0.0.0' 监听所有地址）
 PORT = 8500  # 监听端口
+SOCKET_BUFFER_SIZE = 256 * 1024  # 内核收发缓冲区大小
+RECV_BUFFER_SIZE = 65536  # 用户态接收缓冲区大小
+DEBUG = False  # 为 True 时记录每次收到的数据量
+
+logger = logging.getLogger("tcp_echo_server")
 
 
 def start_server():
@@ -9,26 +15,36 @@ def start_server():
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server_socket:
         # 设置地址重用
         server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        # 在 listen 之前设置收发缓冲区，已接受的连接会继承该设置
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE)
         # 绑定地址和端口
         server_socket.bind((HOST, PORT))
         # 开始监听，最大连接数为 5
         server_socket.listen(5)
         print(f"[*] TCP服务器已启动，监听 {HOST}:{PORT}")
 
+        # 复用同一块接收缓冲区，避免每次 recv 分配新的 bytes
+        buf = bytearray(RECV_BUFFER_SIZE)
+        view = memoryview(buf)
+
         while True:
             # 接受客户端连接
             client_socket, client_address = server_socket.accept()
             print(f"[+] 客户端已连接：{client_address}")
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
 
             with client_socket:
                 while True:
-                    data = client_socket.recv(1024)  # 接收数据
-                    if not data:
+                    n = client_socket.recv_into(buf)  # 接收数据
+                    if not n:
                         print("[-] 客户端已断开连接")
                         break
-                    print(f"[>] 收到数据：{data.decode('utf-8')}")
-                    client_socket.sendall(data)  # 回显数据
+                    if DEBUG:
+                        logger.debug("[>] 收到数据：%d 字节", n)
+                    client_socket.sendall(view[:n])  # 回显数据
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG if DEBUG else logging.INFO)
     start_server()
@@ -1,30 +1,176 @@
+import ctypes
+import ctypes.util
+import errno
+import os
 import socket
+import sys
+import threading
+import time
 
+BATCH_SIZE = 64  # 每次最多收取的数据报数量
+DATAGRAM_SIZE = 1500  # 单个数据报缓冲区大小
+MSG_WAITFORONE = 0x10000  # Linux: 收到第一个数据报后不再阻塞
 
-def udp_server(host='0.0.0.0', port=8000):
-    # 创建 UDP 套接字
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 
-    # 绑定地址和端口
-    server_socket.bind((host, port))
-    print(f"UDP 服务器已启动，监听 {host}:{port}")
+class IOVec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p),
+                ("iov_len", ctypes.c_size_t)]
 
-    try:
+
+class MsgHdr(ctypes.Structure):
+    _fields_ = [("msg_name", ctypes.c_void_p),
+                ("msg_namelen", ctypes.c_uint32),
+                ("msg_iov", ctypes.POINTER(IOVec)),
+                ("msg_iovlen", ctypes.c_size_t),
+                ("msg_control", ctypes.c_void_p),
+                ("msg_controllen", ctypes.c_size_t),
+                ("msg_flags", ctypes.c_int)]
+
+
+class MMsgHdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", MsgHdr),
+                ("msg_len", ctypes.c_uint)]
+
+
+def load_recvmmsg():
+    if not sys.platform.startswith("linux"):
+        return None
+    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    recvmmsg = getattr(libc, "recvmmsg", None)
+    if recvmmsg is not None:
+        recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(MMsgHdr), ctypes.c_uint, ctypes.c_int,
+                             ctypes.c_void_p]
+        recvmmsg.restype = ctypes.c_int
+    return recvmmsg
+
+
+# find_library 会启动子进程查找 libc，整个进程只解析一次，所有接收线程共用
+RECVMMSG = load_recvmmsg()
+
+
+def parse_sockaddr(name):
+    family = int.from_bytes(name[0:2], sys.byteorder)
+    port = int.from_bytes(name[2:4], "big")
+    if family == socket.AF_INET6:
+        return socket.inet_ntop(socket.AF_INET6, name[8:24]), port
+    return socket.inet_ntop(socket.AF_INET, name[4:8]), port
+
+
+class DatagramReceiver:
+    """使用预分配的缓冲区池批量接收数据报，Linux 下一次 recvmmsg 最多收取 BATCH_SIZE 个"""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.bufs = [bytearray(DATAGRAM_SIZE) for _ in range(BATCH_SIZE)]
+        self.views = [memoryview(buf) for buf in self.bufs]
+        self.recvmmsg = RECVMMSG
+        if self.recvmmsg is not None:
+            self.names = [ctypes.create_string_buffer(128) for _ in range(BATCH_SIZE)]
+            self.iovecs = (IOVec * BATCH_SIZE)()
+            self.msgs = (MMsgHdr * BATCH_SIZE)()
+            for i, buf in enumerate(self.bufs):
+                self.iovecs[i].iov_base = ctypes.addressof((ctypes.c_char * DATAGRAM_SIZE).from_buffer(buf))
+                self.iovecs[i].iov_len = DATAGRAM_SIZE
+                hdr = self.msgs[i].msg_hdr
+                hdr.msg_name = ctypes.addressof(self.names[i])
+                hdr.msg_iov = ctypes.pointer(self.iovecs[i])
+                hdr.msg_iovlen = 1
+
+    def recv(self):
+        """阻塞直到至少收到一个数据报，返回 [(数据, 客户端地址), ...]"""
+        if self.recvmmsg is not None:
+            return self.recv_mmsg()
+        return self.recv_drain()
+
+    def recv_mmsg(self):
+        for i in range(BATCH_SIZE):
+            self.msgs[i].msg_hdr.msg_namelen = len(self.names[i])
         while True:
-            # 接收数据和客户端地址
-            data, client_addr = server_socket.recvfrom(1024)
-            message = data.decode('utf-8')
-            print(f"收到来自 {client_addr} 的消息: {message}")
+            count = self.recvmmsg(self.sock.fileno(), self.msgs, BATCH_SIZE, MSG_WAITFORONE, None)
+            if count >= 0:
+                break
+            err = ctypes.get_errno()
+            if err != errno.EINTR:
+                raise OSError(err, "recvmmsg failed")
+        return [(self.views[i][:self.msgs[i].msg_len], parse_sockaddr(self.names[i].raw))
+                for i in range(count)]
+
+    def recv_drain(self):
+        # 第一个数据报阻塞接收，之后以非阻塞方式取走已到达的数据报
+        n, addr = self.sock.recvfrom_into(self.views[0])
+        batch = [(self.views[0][:n], addr)]
+        flags = getattr(socket, "MSG_DONTWAIT", None)
+        if flags is not None:
+            for view in self.views[1:]:
+                try:
+                    n, addr = self.sock.recvfrom_into(view, 0, flags)
+                except BlockingIOError:
+                    break
+                batch.append((view[:n], addr))
+        return batch
+
+
+def serve(server_socket, cpu):
+    # 将接收线程绑定到指定 CPU
+    if cpu is not None:
+        os.sched_setaffinity(0, {cpu})
+
+    receiver = DatagramReceiver(server_socket)
+    while True:
+        # 一次取走所有已到达的数据报
+        for data, client_addr in receiver.recv():
+            # 单个数据报出错不能影响同一批次中的其他数据报
+            try:
+                message = str(data, 'utf-8', errors='replace')
+                print(f"收到来自 {client_addr} 的消息: {message}")
+
+                # 构造响应内容
+                response = f"服务器已收到：{message}"
+                server_socket.sendto(response.encode('utf-8'), client_addr)
+            except OSError as e:
+                print(f"回复 {client_addr} 失败: {e}")
+
+
+def udp_server(host='0.0.0.0', port=8000):
+    # 每个 CPU 一个套接字和接收线程，由内核通过 SO_REUSEPORT 按流分发数据报
+    if hasattr(socket, 'SO_REUSEPORT') and hasattr(os, 'sched_getaffinity'):
+        cpus = sorted(os.sched_getaffinity(0))
+    else:
+        cpus = [None]
+    reuse_port = len(cpus) > 1
+    if reuse_port:
+        # 先不带 SO_REUSEPORT 独占试绑一次，端口已被占用时直接失败，避免与其他进程分摊数据报
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+            probe.bind((host, port))
+
+    server_sockets = []
+    workers = []
+    try:
+        for cpu in cpus:
+            # 创建 UDP 套接字
+            server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            server_sockets.append(server_socket)
+            if reuse_port:
+                server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+
+            # 绑定地址和端口
+            server_socket.bind((host, port))
+            worker = threading.Thread(target=serve, args=(server_socket, cpu), daemon=True)
+            worker.start()
+            workers.append(worker)
+        print(f"UDP 服务器已启动，监听 {host}:{port}，接收线程数 {len(server_sockets)}")
 
-            # 构造响应内容
-            response = f"服务器已收到：{message}"
-            server_socket.sendto(response.encode('utf-8'), client_addr)
+        # 任一接收线程异常退出时关闭全部套接字，避免内核继续向其分发数据报
+        while all(worker.is_alive() for worker in workers):
+            time.sleep(1)
+        print("接收线程异常退出，服务器关闭。")
 
     except KeyboardInterrupt:
         print("\n服务器已退出。")
 
     finally:
-        server_socket.close()
+        for server_socket in server_sockets:
+            server_socket.close()
 
 
 if __name__ == '__main__':